@@ -1,10 +1,34 @@
 import requests
+import fcntl
+import gzip
+import hashlib
 import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import pandas as pd
-import geopandas as gpd
-from flask import Flask
+import pyarrow as pa
+from flask import Flask, Response, jsonify, request
 import folium
+from branca.element import Element, MacroElement
+from jinja2 import Template
 import re
+from requests.adapters import HTTPAdapter
+from shapely.geometry import mapping, shape
+from urllib3.util.retry import Retry
+
+try:
+    import brotli
+except ImportError:  # Pages are served gzip compressed instead
+    brotli = None
+
+try:
+    ARROW_STRING_DTYPE = pd.StringDtype("pyarrow")
+except (TypeError, ImportError):  # Needs pandas 1.3, strings become objects
+    ARROW_STRING_DTYPE = None
 
 COUNTRY_NAME_LOOKUP = {
     "Côte d'Ivoire": "Ivory Coast",
@@ -18,10 +42,251 @@ COUNTRY_NAME_LOOKUP = {
     "Democratic Republic of the Congo": "Democratic Republic of the Congo",
 }
 
+# ISO codes of countries whose GOV.UK name differs from the Natural Earth name
+COUNTRY_ISO_CODES = {
+    "Bosnia and Herzegovina": "BIH",
+    "Central African Republic": "CAF",
+    "Czech Republic": "CZE",
+    "Democratic Republic of the Congo": "COD",
+    "Dominican Republic": "DOM",
+    "Equatorial Guinea": "GNQ",
+    "Eswatini": "SWZ",
+    "Falkland Islands": "FLK",
+    "Solomon Islands": "SLB",
+    "South Sudan": "SSD",
+    "The Bahamas": "BHS",
+    "The Occupied Palestinian Territories": "PSE",
+    "Western Sahara": "ESH",
+}
+
+# Natural Earth 1:110m country shapes, see load_country_geometries
+COUNTRY_GEOMETRIES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "country_geometries.json.gz"
+)
+
+# Tolerance, in degrees, the country shapes are simplified to. The map opens
+# zoomed out to the whole world so coarse shapes are enough
+MAP_GEOMETRY_TOLERANCE = 0.2
+
+# Opening tag of h2 and h3 headings and their id
+HEADING_PATTERN = re.compile(r'<h([23])(?=[\s>])(?:[^>]*?\sid="([^"]*)")?[^>]*>')
+
+# Sections of the entry requirements extracted alongside the COVID entry rules
+ENTRY_REQUIREMENT_SECTIONS = (
+    "testing-on-arrival",
+    "quarantine-requirements",
+    "visas",
+)
+
+# GOV.UK content API allows 10 requests per second per client
+CONTENT_API_RATE_LIMIT = 10
+CONTENT_API_TIMEOUT = 10
+CONTENT_API_MAX_RETRIES = 3
+CONTENT_API_MAX_WORKERS = 8
+# Can be pointed at a stand-in for the content API, such as replay_server.py
+FOREIGN_TRAVEL_ADVICE_URL = os.environ.get(
+    "FOREIGN_TRAVEL_ADVICE_URL", "https://www.gov.uk/api/content/foreign-travel-advice"
+)
+
+# Seconds between background refreshes of the travel advice dataset
+DATASET_REFRESH_INTERVAL = 60 * 60
+DATASET_RETRY_INTERVAL = 60
+
+# Directory country documents are cached in between refreshes and restarts
+CONTENT_API_CACHE_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "content-api"
+)
+
+# Directory snapshots of the dataset are shared between processes through
+# and how often processes check for a new snapshot
+DATASET_SNAPSHOT_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "snapshots"
+)
+DATASET_SNAPSHOT_POLL_INTERVAL = 10
+
+# Columns every process loads from a snapshot, which the map and the
+# countries API need. DATASET_SNAPSHOT_COLUMNS are extra columns loaded on top
+# of them, eg. ["health"], with None loading every column
+DATASET_SNAPSHOT_REQUIRED_COLUMNS = [
+    "name",
+    "value",
+    "updated_at",
+    "entry-requirements",
+    *ENTRY_REQUIREMENT_SECTIONS,
+]
+DATASET_SNAPSHOT_COLUMNS = None
+
 
 app = Flask(__name__)
 
 
+class StageMetrics:
+    """
+    Thread-safe timings of each stage of building the dataset and serving
+    the map
+
+    The stages are listing (fetching the list of countries), fetch (fetching
+    every country's document), parse (decoding each fetched document, which
+    runs within fetch), build (building the DataFrame), extract (extracting
+    the entry requirements), merge (joining the dataset to the country
+    shapes), render (rendering the map) and compress (compressing a page)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # stage -> [count, total seconds, max seconds]
+        self._stages = {}
+
+    @contextmanager
+    def time(self, stage: str):
+        """
+        Times a block of code, or a function when used as a decorator
+
+        Args:
+            stage (str): Name of the stage being timed
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                timings = self._stages.setdefault(stage, [0, 0.0, 0.0])
+                timings[0] += 1
+                timings[1] += elapsed
+                timings[2] = max(timings[2], elapsed)
+
+    def summary(self) -> dict:
+        """
+        Summarises the timings of each stage
+
+        Returns:
+            dict: Dictionary containing each stage and its count, total and
+                max seconds
+        """
+        with self._lock:
+            return {
+                stage: {"count": count, "total": total, "max": maximum}
+                for stage, (count, total, maximum) in self._stages.items()
+            }
+
+
+stage_metrics = StageMetrics()
+
+
+class RateLimiter:
+    """
+    Thread-safe client side rate limiter which spaces out calls evenly
+
+    Args:
+        rate (float): Maximum number of calls per second. A falsy rate
+            disables rate limiting
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def wait(self):
+        """Blocks until the caller is allowed to make its next call"""
+        with self._lock:
+            slot = max(time.monotonic(), self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def create_session(
+    pool_size: int = CONTENT_API_MAX_WORKERS,
+    max_retries: int = CONTENT_API_MAX_RETRIES,
+) -> requests.Session:
+    """
+    Creates a requests.Session sharing a pool of connections to the API
+
+    Args:
+        pool_size (int): Number of connections kept open per host
+        max_retries (int): Number of retries, with exponential backoff, for
+            connection errors and throttled or failed responses
+    Returns:
+        requests.Session: Session with retrying adapters mounted
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class HtmlSectionIndex:
+    """
+    Index of the sections of an HTML body, which is split into a section at
+    each h2 and h3 heading in a single pass
+
+    Args:
+        html (str): HTML formatted as a str
+    """
+
+    def __init__(self, html: str):
+        self.html = html
+        # Start position and level of each heading, in order
+        self.headings = []
+        # Heading id -> position of the heading in self.headings
+        self.ids = {}
+
+        for match in HEADING_PATTERN.finditer(html):
+            level, heading_id = match.groups()
+            if heading_id is not None:
+                self.ids.setdefault(heading_id, len(self.headings))
+            self.headings.append((match.start(), level))
+
+    def section(self, heading_id: str) -> str:
+        """
+        Gets a section, from its heading up to the next h2 or h3 heading
+
+        Args:
+            heading_id (str): id of the section's heading
+        Returns:
+            str: HTML of the section, an empty string if there is no heading
+                with this id
+        """
+        position = self.ids.get(heading_id)
+        if position is None:
+            return ""
+
+        start = self.headings[position][0]
+        if position + 1 < len(self.headings):
+            end = self.headings[position + 1][0]
+        else:
+            end = len(self.html)
+        return self.html[start:end].rstrip()
+
+    def covid_requirements(self) -> str:
+        """
+        Gets the entry requirements in response to coronavirus
+
+        Returns:
+            str: HTML from the first "Entry to ..." h3 heading up to the first
+                paragraph followed by an h3 heading
+        """
+        for position, (start, level) in enumerate(self.headings):
+            if level == "3" and self.html.startswith('<h3 id="entry-to-', start):
+                for end, next_level in self.headings[position + 1 :]:
+                    if next_level == "3" and self.html.endswith("</p>\n\n", start, end):
+                        return self.html[start : end - 2]
+                break
+
+        return "No entry rules in response to coronavirus are listed"
+
+
 def extract_covid_requirements(string: str) -> str:
     """
     Extracts entry requirements to a country from string
@@ -31,30 +296,283 @@ def extract_covid_requirements(string: str) -> str:
     Returns:
         str: Extracted entry requirements for a given country
     """
-    try:
-        covid_entry_requirements = (
-            '<h3 id="entry-to-'
-            + re.findall(
-                r'h3 id="entry-to-(.+?)</p>\n\n<h3',
-                string,
-                re.DOTALL,
-            )[0]
-            + "</p>"
-        )
-    except IndexError:
-        covid_entry_requirements = (
-            "No entry rules in response to coronavirus are listed"
-        )
-    return covid_entry_requirements
+    return HtmlSectionIndex(string).covid_requirements()
+
+
+@stage_metrics.time("extract")
+def extract_entry_requirement_sections(entry_requirements: list) -> list:
+    """
+    Extracts the COVID entry requirements and ENTRY_REQUIREMENT_SECTIONS from
+    the entry requirements of each country, indexing each body only once
+
+    Args:
+        entry_requirements (list): HTML of the entry requirements of each
+            country
+    Returns:
+        list: Dictionary for each country containing the extracted
+            entry-requirements and each section in ENTRY_REQUIREMENT_SECTIONS
+    """
+    extracted = []
+
+    for html in entry_requirements:
+        sections = HtmlSectionIndex(html)
+        country_sections = {"entry-requirements": sections.covid_requirements()}
+        for heading_id in ENTRY_REQUIREMENT_SECTIONS:
+            country_sections[heading_id] = sections.section(heading_id)
+        extracted.append(country_sections)
+
+    return extracted
+
+
+class TravelAdviceDatasetBuilder:
+    """
+    Collects the parts of each country document column by column so the
+    dataset can be built in a single step rather than one row at a time
+    """
+
+    def __init__(self):
+        self._columns = {}
+        self._names = []
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, document: dict):
+        """
+        Adds the parts of a content API document as a new row
+
+        Args:
+            document (dict): Parsed JSON document for a single country
+        """
+        row = len(self._names)
+        self._names.append(document["details"]["country"]["name"])
+
+        for part in document["details"]["parts"]:
+            column = self._columns.setdefault(part["slug"], [])
+            if len(column) > row:
+                # Repeated slug within a document, keep the last body
+                column[row] = part["body"]
+            else:
+                column.extend([None] * (row - len(column)))
+                column.append(part["body"])
+
+    def build(self) -> pd.DataFrame:
+        """
+        Builds pd.DataFrame from the documents added so far
+
+        Returns:
+            pd.DataFrame: pd.DataFrame where each country is a row and each
+                column represents travel advice about a specific topic
+        Notes:
+            NaNs will be filled with an empty string
+        """
+        rows = len(self._names)
+        for column in self._columns.values():
+            column.extend([None] * (rows - len(column)))
+
+        dataset = pd.DataFrame(self._columns, index=pd.RangeIndex(rows))
 
+        # Update country lists to remove naming inconsistancies between countries
+        dataset["name"] = [COUNTRY_NAME_LOOKUP.get(item, item) for item in self._names]
 
-def build_foreign_travel_advice_dataset(country_urls: dict) -> pd.DataFrame:
+        # Fill missing values in dataset
+        return dataset.fillna("")
+
+
+class CountryDocumentCache:
+    """
+    Persistent cache of content API documents keyed by their api_url
+
+    Each entry holds the document along with its updated_at timestamp and the
+    ETag and Last-Modified headers it was served with, so that it can be
+    revalidated with a conditional GET. Entries are kept in memory and written
+    to one JSON file per document so the cache survives restarts.
+
+    Args:
+        directory (str): Directory the cache is stored in. If None entries are
+            only kept in memory
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory
+        self._entries = {}
+
+    def _path(self, api_url: str) -> str:
+        filename = hashlib.sha1(api_url.encode()).hexdigest() + ".json"
+        return os.path.join(self.directory, filename)
+
+    def get(self, api_url: str) -> dict:
+        """
+        Gets the cached entry for a document
+
+        Args:
+            api_url (str): Content API url of the document
+        Returns:
+            dict: Entry with the document, updated_at, etag and last_modified,
+                None if the document isn't cached
+        """
+        entry = self._entries.get(api_url)
+
+        if entry is None and self.directory is not None:
+            try:
+                with open(self._path(api_url), encoding="utf-8") as cache_file:
+                    entry = json.load(cache_file)
+            except (OSError, ValueError):
+                return None
+            self._entries[api_url] = entry
+
+        return entry
+
+    def set(self, api_url: str, entry: dict):
+        """
+        Caches the entry for a document
+
+        Args:
+            api_url (str): Content API url of the document
+            entry (dict): Entry with the document, updated_at, etag and
+                last_modified
+        """
+        self._entries[api_url] = entry
+
+        if self.directory is None:
+            return
+
+        # Write to a temporary file first so a crash can't corrupt the entry
+        path = self._path(api_url)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temporary_path, "w", encoding="utf-8") as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(temporary_path, path)
+        except OSError:
+            # The cache is only an optimisation, so keep the entry in memory
+            app.logger.warning("Failed to cache %s on disk", api_url, exc_info=True)
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+
+@stage_metrics.time("build")
+def build_dataset_from_documents(documents: list) -> pd.DataFrame:
+    """
+    Builds pd.DataFrame from content API documents
+
+    Args:
+        documents (list): (url, document) pairs for each country
+    Returns:
+        pd.DataFrame: pd.DataFrame where each country is a row and each column
+            represents travel advice about a specific topic eg. Terrorism
+    """
+    builder = TravelAdviceDatasetBuilder()
+
+    for _, res in documents:
+        builder.add(res)
+
+    return builder.build()
+
+
+@stage_metrics.time("fetch")
+def fetch_country_documents(
+    country_urls: dict,
+    max_workers: int = CONTENT_API_MAX_WORKERS,
+    rate_limit: float = CONTENT_API_RATE_LIMIT,
+    timeout: float = CONTENT_API_TIMEOUT,
+    max_retries: int = CONTENT_API_MAX_RETRIES,
+    cache: CountryDocumentCache = None,
+    updated_at: dict = None,
+) -> list:
+    """
+    Fetches the content API document for each country concurrently
+
+    Args:
+        country_urls (dict): Dictionary containing the name of the country and
+            the url containing the travel advice
+        max_workers (int): Maximum number of requests in flight at once
+        rate_limit (float): Maximum number of requests made per second
+        timeout (float): Timeout in seconds for each request
+        max_retries (int): Number of retries for each request
+        cache (CountryDocumentCache): Cache of previously fetched documents
+        updated_at (dict): Dictionary containing the url and the time the
+            travel advice was last updated, as listed by the content API
+    Returns:
+        list: (url, document) pairs in the same order as country_urls
+    Notes:
+        Missing or malformed urls are skipped. Cached documents whose
+        updated_at matches the listing are used without a request, other
+        cached documents are revalidated with a conditional GET
+    """
+    rate_limiter = RateLimiter(rate_limit)
+    updated_at = updated_at or {}
+
+    with create_session(max_workers, max_retries) as session:
+
+        def fetch(link):
+            entry = cache.get(link) if cache is not None else None
+            listed_updated_at = updated_at.get(link)
+
+            if (
+                entry is not None
+                and listed_updated_at is not None
+                and entry["updated_at"] == listed_updated_at
+            ):
+                return link, entry["document"]
+
+            headers = {}
+            if entry is not None:
+                if entry["etag"]:
+                    headers["If-None-Match"] = entry["etag"]
+                if entry["last_modified"]:
+                    headers["If-Modified-Since"] = entry["last_modified"]
+
+            try:
+                rate_limiter.wait()
+                html = session.get(link, timeout=timeout, headers=headers)
+            except (requests.exceptions.MissingSchema, requests.exceptions.InvalidURL):
+                # Newer urllib3 reports malformed urls as InvalidURL
+                return link, None
+
+            if entry is not None and html.status_code == 304:
+                document = entry["document"]
+                etag = html.headers.get("ETag", entry["etag"])
+                last_modified = html.headers.get(
+                    "Last-Modified", entry["last_modified"]
+                )
+            else:
+                with stage_metrics.time("parse"):
+                    document = json.loads(html.content.decode())
+                etag = html.headers.get("ETag")
+                last_modified = html.headers.get("Last-Modified")
+
+            if cache is not None and html.status_code in (200, 304):
+                cache.set(
+                    link,
+                    {
+                        "updated_at": listed_updated_at or document.get("updated_at"),
+                        "etag": etag,
+                        "last_modified": last_modified,
+                        "document": document,
+                    },
+                )
+
+            return link, document
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            documents = list(executor.map(fetch, country_urls.values()))
+
+    return [(link, document) for link, document in documents if document is not None]
+
+
+def build_foreign_travel_advice_dataset(
+    country_urls: dict, max_workers: int = CONTENT_API_MAX_WORKERS
+) -> pd.DataFrame:
     """
     Builds pd.DataFrame containing foreign travel advice for each country
 
     Args:
         urls (dict): Dictionary containing the name of the country and the url
             containing the travel advice
+        max_workers (int): Maximum number of countries fetched at once. Set to
+            1 to fetch each country in turn
     Returns:
         pd.DataFrame: pd.DataFrame where each country is a row and each column
             represents travel advice about a specific topic eg. Terrorism
@@ -62,85 +580,638 @@ def build_foreign_travel_advice_dataset(country_urls: dict) -> pd.DataFrame:
         NaNs will be filled with an empty string
     """
     # Extract data for each category for each country
-    dataset = pd.DataFrame()
-    country_list = []
+    return build_dataset_from_documents(
+        fetch_country_documents(country_urls, max_workers=max_workers)
+    )
+
+
+@stage_metrics.time("listing")
+def fetch_travel_advice_listing(
+    url: str = FOREIGN_TRAVEL_ADVICE_URL, timeout: float = CONTENT_API_TIMEOUT
+) -> list:
+    """
+    Fetches the list of countries with foreign travel advice
+
+    Args:
+        url (str): Content API url listing foreign travel advice
+        timeout (float): Timeout in seconds for the request
+    Returns:
+        list: Content API link for each country, including its api_url and
+            when its travel advice was last updated
+    """
+    # Call data from API
+    with create_session() as session:
+        travel_advice_html = session.get(url, timeout=timeout)
+    travel_advice_res = json.loads(travel_advice_html.content)
+
+    return travel_advice_res["links"]["children"]
+
+
+class TravelAdviceDatasetLoader:
+    """
+    Builds the dataset of travel advice shown on the map
+
+    Only countries whose advice changed since the previous load are fetched
+    again and have their COVID entry requirements extracted again, the rest
+    are reused from the document cache and the previous load.
+
+    Args:
+        cache (CountryDocumentCache): Cache of country documents. If None
+            every country is fetched on each load
+        url (str): Content API url listing foreign travel advice
+        max_workers (int): Maximum number of countries fetched at once
+        rate_limit (float): Maximum number of requests made per second
+    """
+
+    def __init__(
+        self,
+        cache: CountryDocumentCache = None,
+        url: str = FOREIGN_TRAVEL_ADVICE_URL,
+        max_workers: int = CONTENT_API_MAX_WORKERS,
+        rate_limit: float = CONTENT_API_RATE_LIMIT,
+    ):
+        self.cache = cache
+        self.url = url
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        # api_url -> (entry requirements html, extracted sections)
+        self._entry_requirements = {}
 
-    for link in country_urls.values():
+    def __call__(self) -> pd.DataFrame:
+        # Parse through JSON to find country links and when they were updated
+        countries = {}
+        updated_at = {}
+
+        for doc in fetch_travel_advice_listing(self.url):
+            countries[doc["details"]["country"]["name"]] = doc["api_url"]
+            updated_at[doc["api_url"]] = doc.get("updated_at") or doc.get(
+                "public_updated_at"
+            )
+
+        # Build dataset of foreign travel advice
+        documents = fetch_country_documents(
+            countries,
+            max_workers=self.max_workers,
+            rate_limit=self.rate_limit,
+            cache=self.cache,
+            updated_at=updated_at,
+        )
+        travel_advice_dataset = build_dataset_from_documents(documents)
+
+        # Extract COVID entry requirements from html of the countries which changed
+        entry_requirements = {}
+        changed = []
+        for (link, _), html in zip(
+            documents, travel_advice_dataset["entry-requirements"]
+        ):
+            previous = self._entry_requirements.get(link)
+            if previous is None or previous[0] != html:
+                changed.append((link, html))
+            else:
+                entry_requirements[link] = previous
+
+        extracted = extract_entry_requirement_sections([html for _, html in changed])
+        for (link, html), sections in zip(changed, extracted):
+            entry_requirements[link] = (html, sections)
+        self._entry_requirements = entry_requirements
+
+        travel_advice_dataset["entry-requirements"] = [
+            entry_requirements[link][1]["entry-requirements"] for link, _ in documents
+        ]
+
+        # Extract basic values to visualise on map
+        travel_advice_dataset["value"] = travel_advice_dataset[
+            "entry-requirements"
+        ].apply(
+            lambda x: (
+                0
+                if x == "No entry rules in response to coronavirus are listed"
+                else 100
+            )
+        )
+
+        for heading_id in ENTRY_REQUIREMENT_SECTIONS:
+            travel_advice_dataset[heading_id] = [
+                entry_requirements[link][1][heading_id] for link, _ in documents
+            ]
+
+        # When each country's travel advice was last updated
+        travel_advice_dataset["updated_at"] = [
+            res.get("public_updated_at") or updated_at[link] for link, res in documents
+        ]
+
+        return travel_advice_dataset
+
+
+class DatasetSnapshots:
+    """
+    Versioned snapshots of the travel advice dataset shared between processes
+
+    One process holds the writer lock, builds the dataset and writes each
+    version to an Arrow IPC file before pointing the CURRENT file at it. Every
+    process, including the writer, memory maps the current snapshot read-only
+    so its strings stay in the shared page cache instead of being copied into
+    each process. If the writer exits another process takes over the lock.
+
+    Args:
+        directory (str): Directory the snapshots are written to
+        columns (list): Extra columns to load on top of
+            DATASET_SNAPSHOT_REQUIRED_COLUMNS, None to load every column
+        keep (int): Number of snapshots kept on disk
+    """
+
+    def __init__(
+        self,
+        directory: str = DATASET_SNAPSHOT_DIRECTORY,
+        columns: list = DATASET_SNAPSHOT_COLUMNS,
+        keep: int = 2,
+    ):
+        self.directory = directory
+        self.columns = columns
+        self.keep = keep
+        self._lock_file = None
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def acquire_writer(self) -> bool:
+        """
+        Tries to become the process which writes snapshots
+
+        Returns:
+            bool: Whether this process holds the writer lock
+        """
+        if self._lock_file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            lock_file = open(self._path("writer.lock"), "w", encoding="utf-8")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file
+
+        return True
+
+    def current_version(self) -> int:
+        """
+        Gets the version of the current snapshot
+
+        Returns:
+            int: Version of the current snapshot, None if none has been written
+        """
         try:
-            html = requests.get(link)
-            res = json.loads(html.content.decode())
+            with open(self._path("CURRENT"), encoding="utf-8") as current_file:
+                return int(current_file.read())
+        except (OSError, ValueError):
+            return None
 
-            country_list.append(res["details"]["country"]["name"])
+    def write(self, dataset: pd.DataFrame) -> int:
+        """
+        Writes the dataset as the next snapshot and makes it current
 
-            country_content = {}
+        Args:
+            dataset (pd.DataFrame): Dataset to write
+        Returns:
+            int: Version of the snapshot
+        """
+        version = (self.current_version() or 0) + 1
+        table = pa.Table.from_pandas(dataset, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), b"loaded_at": str(time.time()).encode()}
+        )
 
-            for part in res["details"]["parts"]:
-                country_content[part["slug"]] = part["body"]
+        # Write to temporary files first so readers never see a partial file
+        path = self._path(f"travel-advice-{version:010d}.arrow")
+        with pa.OSFile(f"{path}.tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(f"{path}.tmp", path)
 
-            country_data = pd.DataFrame(country_content, index=[0])
+        with open(self._path("CURRENT.tmp"), "w", encoding="utf-8") as current_file:
+            current_file.write(str(version))
+        os.replace(self._path("CURRENT.tmp"), self._path("CURRENT"))
 
-            dataset = pd.concat([dataset, country_data], ignore_index=True)
-        except requests.exceptions.MissingSchema:
-            continue
+        # Processes still mapping an older snapshot keep it until they unmap it
+        for old_version in range(version - self.keep, 0, -1):
+            old_path = self._path(f"travel-advice-{old_version:010d}.arrow")
+            if not os.path.exists(old_path):
+                break
+            os.remove(old_path)
 
-    # Update country lists to remove naming inconsistancies between countries
-    country_list = [COUNTRY_NAME_LOOKUP.get(item, item) for item in country_list]
-    dataset["name"] = country_list
+        return version
 
-    # Fill missing values in dataset
-    dataset = dataset.fillna("")
+    def read(self) -> tuple:
+        """
+        Memory maps the current snapshot
 
-    return dataset
+        Returns:
+            tuple: The dataset, its version and the time it was loaded, None if
+                no snapshot has been written
+        """
+        version = self.current_version()
+        if version is None:
+            return None
 
+        source = pa.memory_map(self._path(f"travel-advice-{version:010d}.arrow"))
+        table = pa.ipc.open_file(source).read_all()
+        loaded_at = float(table.schema.metadata[b"loaded_at"])
+        if self.columns is not None:
+            columns = DATASET_SNAPSHOT_REQUIRED_COLUMNS + self.columns
+            table = table.select([c for c in table.column_names if c in columns])
 
-# Call data from API
-travel_advice_html = requests.get(
-    "https://www.gov.uk/api/content/foreign-travel-advice"
-)
-travel_advice_res = json.loads(travel_advice_html.content)
+        # Keep strings in the mapped Arrow buffers rather than Python objects
+        types_mapper = None
+        if ARROW_STRING_DTYPE is not None:
+            types_mapper = {
+                pa.string(): ARROW_STRING_DTYPE,
+                pa.large_string(): ARROW_STRING_DTYPE,
+            }.get
+        dataset = table.to_pandas(types_mapper=types_mapper)
+        return dataset, version, loaded_at
 
-# Parse through JSON to find country links
-countries = {}
 
-for doc in travel_advice_res["links"]["children"]:
-    countries[doc["details"]["country"]["name"]] = doc["api_url"]
+class TravelAdviceDatasetStore:
+    """
+    Holds the latest travel advice dataset and refreshes it in the background
 
-# Build dataset of foreign travel advice
-travel_advice_dataset = build_foreign_travel_advice_dataset(countries)
+    Each refresh builds a new dataset and swaps it in as a whole, so readers
+    which take a snapshot never see a partially built dataset. Until the first
+    refresh completes the snapshot holds an empty (or the given initial)
+    dataset.
 
-# Extract COVID entry requirements from html
-travel_advice_dataset["entry-requirements"] = travel_advice_dataset[
-    "entry-requirements"
-].apply(lambda x: extract_covid_requirements(x))
+    Args:
+        loader (callable): Function returning a freshly built dataset. By
+            default a TravelAdviceDatasetLoader caching documents on disk
+        refresh_interval (float): Seconds between refreshes
+        retry_interval (float): Seconds to wait before retrying a failed
+            refresh
+        initial_dataset (pd.DataFrame): Dataset served before the first
+            refresh completes
+        snapshots (DatasetSnapshots): Snapshots to share the dataset with
+            other processes through. Only the process holding the writer lock
+            calls the loader, every process loads the current snapshot
+        poll_interval (float): Seconds between checks for a new snapshot
+    """
 
-# Extract basic values to visualise on map
-travel_advice_dataset["value"] = travel_advice_dataset["entry-requirements"].apply(
-    lambda x: 0 if x == "No entry rules in response to coronavirus are listed" else 100
-)
+    def __init__(
+        self,
+        loader=None,
+        refresh_interval: float = DATASET_REFRESH_INTERVAL,
+        retry_interval: float = DATASET_RETRY_INTERVAL,
+        initial_dataset: pd.DataFrame = None,
+        snapshots: DatasetSnapshots = None,
+        poll_interval: float = DATASET_SNAPSHOT_POLL_INTERVAL,
+    ):
+        if initial_dataset is None:
+            initial_dataset = pd.DataFrame(
+                columns=["name", "value", "entry-requirements"]
+            )
 
+        if loader is None:
+            loader = TravelAdviceDatasetLoader(
+                CountryDocumentCache(CONTENT_API_CACHE_DIRECTORY)
+            )
 
-@app.route("/")
-def index():
-    # Get map data
-    url = "https://raw.githubusercontent.com/python-visualization/folium/master/examples/data"
-    country_shapes = f"{url}/world-countries.json"
-
-    # Parse geodata and combine with foreign office travel advice data
-    geoJSON_df = gpd.read_file(country_shapes)
-    final_df = geoJSON_df.merge(
-        travel_advice_dataset[["name", "value", "entry-requirements"]], on="name"
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.snapshots = snapshots
+        self.poll_interval = poll_interval
+        # (dataset, version, loaded_at) is replaced in a single assignment
+        self._snapshot = (initial_dataset, 0, None)
+        self._refresh_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def snapshot(self) -> tuple:
+        """
+        Returns the current dataset, starting the background refresh if needed
+
+        Returns:
+            tuple: The dataset, its version and the time it was loaded, which
+                is None while no dataset has been loaded
+        """
+        self.start()
+        return self._snapshot
+
+    @property
+    def dataset(self) -> pd.DataFrame:
+        return self._snapshot[0]
+
+    @property
+    def version(self) -> int:
+        return self._snapshot[1]
+
+    @property
+    def loaded_at(self) -> float:
+        return self._snapshot[2]
+
+    @property
+    def age(self) -> float:
+        """Seconds since the dataset was loaded, None if not loaded yet"""
+        loaded_at = self.loaded_at
+        return None if loaded_at is None else time.time() - loaded_at
+
+    def refresh(self) -> int:
+        """
+        Builds a new dataset and swaps it in
+
+        When sharing snapshots, only the writer builds a new dataset and only
+        once the current snapshot is older than the refresh interval or can't
+        be read. Every process swaps in the current snapshot if it's a
+        different version to its own.
+
+        Returns:
+            int: Version of the dataset
+        """
+        with self._refresh_lock:
+            if self.snapshots is None:
+                dataset = self.loader()
+                version = self._snapshot[1] + 1
+                self._snapshot = (dataset, version, time.time())
+                return version
+
+            try:
+                self._read_snapshot()
+                unreadable = False
+            except (OSError, ValueError, KeyError, pa.ArrowException):
+                # eg. the file was cleaned up or written by an incompatible
+                # version of pyarrow, so the writer replaces it
+                app.logger.warning("Failed to read dataset snapshot", exc_info=True)
+                unreadable = True
+
+            if self.snapshots.acquire_writer():
+                loaded_at = self._snapshot[2]
+                if (
+                    unreadable
+                    or loaded_at is None
+                    or time.time() - loaded_at >= self.refresh_interval
+                ):
+                    self.snapshots.write(self.loader())
+                    self._read_snapshot()
+
+        return self._snapshot[1]
+
+    def _read_snapshot(self):
+        version = self.snapshots.current_version()
+        if version is not None and version != self._snapshot[1]:
+            self._snapshot = self.snapshots.read()
+
+    def start(self):
+        """Starts refreshing the dataset in a background thread"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name="travel-advice-refresh", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stops the background refresh"""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+                if self.snapshots is None:
+                    interval = self.refresh_interval
+                else:
+                    interval = self.poll_interval
+            except Exception:  # pylint: disable=broad-except
+                app.logger.exception("Failed to refresh travel advice dataset")
+                interval = self.retry_interval
+            self._stopped.wait(interval)
+
+
+travel_advice_store = TravelAdviceDatasetStore(snapshots=DatasetSnapshots())
+
+
+class CountryGeometryStore:
+    """
+    Simplified country shapes and an index from country names to ISO codes
+    for joining them to the travel advice
+
+    Args:
+        countries (list): Country records each with an iso code, name and
+            GeoJSON geometry
+        tolerance (float): Tolerance, in degrees, to simplify shapes to. A
+            tolerance of 0 keeps the shapes as they are
+    """
+
+    def __init__(self, countries: list, tolerance: float = MAP_GEOMETRY_TOLERANCE):
+        self.names = {country["iso"]: country["name"] for country in countries}
+        self.geometries = {}
+
+        for country in countries:
+            geometry = shape(country["geometry"])
+            if tolerance:
+                geometry = geometry.simplify(tolerance, preserve_topology=True)
+            self.geometries[country["iso"]] = mapping(geometry)
+
+        # Index every known name of a country so joining is a dictionary lookup
+        self.country_keys = {}
+        for iso, name in self.names.items():
+            self.country_keys[iso.casefold()] = iso
+            self.country_keys[name.casefold()] = iso
+        for name, iso in COUNTRY_ISO_CODES.items():
+            self.country_keys[name.casefold()] = iso
+        for name, alias in COUNTRY_NAME_LOOKUP.items():
+            iso = self.iso_code(name) or self.iso_code(alias)
+            if iso is not None:
+                self.country_keys[name.casefold()] = iso
+                self.country_keys[alias.casefold()] = iso
+
+    def iso_code(self, name: str) -> str:
+        """
+        Finds the ISO code of a country
+
+        Args:
+            name (str): Name, alias or ISO code of the country
+        Returns:
+            str: ISO 3166-1 alpha-3 code, None if the country isn't known
+        """
+        return self.country_keys.get(name.casefold())
+
+    def feature_collection(self, properties: dict) -> dict:
+        """
+        Builds GeoJSON for the countries which have properties
+
+        Args:
+            properties (dict): Dictionary containing the ISO code of each
+                country and the properties of its feature
+        Returns:
+            dict: GeoJSON FeatureCollection with the ISO code as feature id
+        """
+        features = [
+            {
+                "type": "Feature",
+                "id": iso,
+                "properties": country_properties,
+                "geometry": self.geometries[iso],
+            }
+            for iso, country_properties in properties.items()
+            if iso in self.geometries
+        ]
+        return {"type": "FeatureCollection", "features": features}
+
+
+def load_country_geometries(
+    path: str = COUNTRY_GEOMETRIES_PATH, tolerance: float = MAP_GEOMETRY_TOLERANCE
+) -> CountryGeometryStore:
+    """
+    Loads the vendored country shapes
+
+    Args:
+        path (str): Path to the gzipped JSON of Natural Earth country shapes
+        tolerance (float): Tolerance, in degrees, to simplify shapes to
+    Returns:
+        CountryGeometryStore: Store of country shapes
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as geometries_file:
+        countries = json.load(geometries_file)["countries"]
+
+    return CountryGeometryStore(countries, tolerance)
+
+
+country_geometries = load_country_geometries()
+
+
+class LazyCountryTooltip(MacroElement):
+    """
+    Tooltip for each country of a GeoJson layer which fetches the country's
+    entry requirements from /api/countries the first time it is hovered over
+    or clicked
+
+    Args:
+        url (str): Url of the countries API
+        style (str): CSS applied to the tooltips
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function () {
+            var requested = {};
+            {{ this._parent.get_name() }}.eachLayer(function (layer) {
+                var iso = layer.feature.id;
+                layer.bindTooltip("Loading...", {
+                    sticky: true,
+                    className: "entry-requirements-tooltip"
+                });
+                function load() {
+                    if (requested[iso]) {
+                        return;
+                    }
+                    requested[iso] = true;
+                    fetch("{{ this.url }}/" + encodeURIComponent(iso))
+                        .then(function (response) {
+                            // Retry errors on the next hover rather than
+                            // showing the error body as the tooltip
+                            if (!response.ok) {
+                                throw new Error(response.statusText);
+                            }
+                            return response.json();
+                        })
+                        .then(function (country) {
+                            layer.setTooltipContent(
+                                "<h4>" + country["name"] + "</h4>"
+                                + country["entry-requirements"]
+                            );
+                        })
+                        .catch(function () { requested[iso] = false; });
+                }
+                layer.on("mouseover", load);
+                layer.on("click", load);
+            });
+        })();
+        {% endmacro %}
+        """)
+
+    def __init__(
+        self,
+        url: str = "/api/countries",
+        style: str = (
+            "overflow-wrap: break-word; background-color: white; color: black; "
+            "margin: auto; max-width: 500px; white-space: normal;"
+        ),
+    ):
+        super().__init__()
+        self._name = "LazyCountryTooltip"
+        self.url = url
+        self.style = style
+
+    def render(self, **kwargs):
+        super().render(**kwargs)
+        self.get_root().header.add_child(
+            Element(f"<style>.entry-requirements-tooltip {{{self.style}}}</style>"),
+            name="entry_requirements_tooltip_style",
+        )
+
+
+@stage_metrics.time("merge")
+def join_travel_advice_to_countries(travel_advice_dataset: pd.DataFrame) -> dict:
+    """
+    Joins the travel advice to the country shapes by ISO code
+
+    Args:
+        travel_advice_dataset (pd.DataFrame): Dataset of foreign travel advice
+    Returns:
+        dict: Dictionary containing the ISO code of each country with travel
+            advice and the properties of its feature on the map
+    """
+    properties = {}
+    for name, value in zip(
+        travel_advice_dataset["name"], travel_advice_dataset["value"]
+    ):
+        iso = country_geometries.iso_code(name)
+        if iso is not None:
+            properties[iso] = {"value": int(value)}
+
+    return properties
+
+
+@stage_metrics.time("render")
+def render_choropleth_map(properties: dict) -> str:
+    """
+    Renders a choropleth map of the countries' values as HTML
+
+    Args:
+        properties (dict): Dictionary containing the ISO code of each country
+            and the properties of its feature, including its value
+    Returns:
+        str: HTML of the folium map
+    """
+    geo_data = country_geometries.feature_collection(properties)
+    values = pd.DataFrame(
+        {
+            "iso": list(properties),
+            "value": [country["value"] for country in properties.values()],
+        }
     )
 
     # Instantiate map
     the_map = folium.Map(tiles="cartodbpositron", location=[40, 34], zoom_start=2)
 
+    # Nothing to plot until the dataset has loaded
+    if not properties:
+        return the_map._repr_html_()
+
     # Add choropleth layer
     choropleth = folium.Choropleth(
-        geo_data=final_df,
+        geo_data=geo_data,
         name="choropleth",
-        data=final_df,
-        columns=["name", "value"],
-        key_on="feature.properties.name",
+        data=values,
+        columns=["iso", "value"],
+        key_on="feature.id",
         fill_color="YlOrBr",
         nan_fill_color="black",
         fill_opacity=0.7,
@@ -151,19 +1222,316 @@ def index():
     folium.LayerControl().add_to(the_map)
 
     # Add tool tip HTML
-    choropleth.geojson.add_child(
-        folium.features.GeoJsonTooltip(
-            ["name", "entry-requirements"],
-            labels=False,
-            style=(
-                "overflow-wrap: break-word; background-color: white; color: black; margin: auto;"
-            ),
-            localize=True,
+    choropleth.geojson.add_child(LazyCountryTooltip())
+
+    return the_map._repr_html_()
+
+
+def render_travel_advice_map(travel_advice_dataset: pd.DataFrame) -> str:
+    """
+    Renders the map of COVID entry requirements as HTML
+
+    Args:
+        travel_advice_dataset (pd.DataFrame): Dataset of foreign travel advice
+            with the COVID entry requirements extracted
+    Returns:
+        str: HTML of the folium map
+    """
+    # Combine country shapes with foreign office travel advice data. Entry
+    # requirements are fetched from the API when a country is hovered over
+    return render_choropleth_map(join_travel_advice_to_countries(travel_advice_dataset))
+
+
+class RenderedPage:
+    """
+    Rendered page along with precompressed copies of it
+
+    Args:
+        html (str): Rendered HTML, or other content of the page
+        mimetype (str): Mimetype of the page
+    """
+
+    def __init__(self, html: str, mimetype: str = "text/html"):
+        self.mimetype = mimetype
+        body = html.encode("utf-8")
+        self.etag = hashlib.sha1(body).hexdigest()
+
+        with stage_metrics.time("compress"):
+            self.bodies = {"identity": body, "gzip": gzip.compress(body, mtime=0)}
+            if brotli is not None:
+                self.bodies["br"] = brotli.compress(body)
+
+    def response(self, page_request) -> Response:
+        """
+        Builds the response to a request for the page
+
+        Args:
+            page_request (flask.Request): Request for the page
+        Returns:
+            Response: The page in the best encoding the client accepts, or 304
+                Not Modified if the client already has it
+        """
+        encoding = "identity"
+        for candidate in ("br", "gzip"):
+            if candidate in self.bodies and page_request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        response = Response(self.bodies[encoding], mimetype=self.mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        response.set_etag(f"{self.etag}-{encoding}")
+
+        return response.make_conditional(page_request)
+
+
+class DatasetVersionCache:
+    """
+    Caches an object built from the travel advice dataset until the dataset
+    changes
+
+    Concurrent requests for an object which isn't cached wait for a single
+    build rather than each building it.
+
+    Args:
+        build (callable): Function building the object from the dataset
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.hits = 0
+        self.misses = 0
+        # (dataset version, object) is replaced in a single assignment
+        self._cached = (None, None)
+        self._build_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def get(self, dataset: pd.DataFrame, version: int):
+        """
+        Gets the object for a version of the dataset, building it if needed
+
+        Args:
+            dataset (pd.DataFrame): Dataset to build the object from
+            version (int): Version of the dataset
+        Returns:
+            object: Object built from this version
+        """
+        cached = self._lookup(version)
+
+        if cached is None:
+            with self._build_lock:
+                cached = self._lookup(version)
+                if cached is None:
+                    cached = self.build(dataset)
+                    self._cached = (version, cached)
+                    with self._stats_lock:
+                        self.misses += 1
+
+        return cached
+
+    def _lookup(self, version: int):
+        cached_version, cached = self._cached
+        # Versions restart from 1 if the snapshots are reset, so a higher
+        # cached version isn't necessarily newer
+        if cached_version != version:
+            return None
+        with self._stats_lock:
+            self.hits += 1
+        return cached
+
+
+class RenderedPageCache(DatasetVersionCache):
+    """
+    Caches a page rendered from the travel advice dataset until the dataset
+    changes
+
+    Args:
+        render (callable): Function rendering the dataset as HTML
+    """
+
+    def __init__(self, render):
+        super().__init__(lambda dataset: RenderedPage(render(dataset)))
+
+
+class TravelAdviceApi:
+    """
+    JSON responses of the countries API for a version of the travel advice
+    dataset
+
+    The list of countries is serialised up front. Only an index from each
+    country's name and ISO code to its row is kept, with the response for a
+    country built from the dataset when it is requested. The dataset may be
+    memory mapped from a snapshot, so building from it rather than copying
+    every row keeps the travel advice out of each process. The most recently
+    requested countries' responses are cached.
+
+    Args:
+        dataset (pd.DataFrame): Dataset of foreign travel advice
+    """
+
+    summary_columns = ["name", "iso", "value", "updated_at"]
+    max_cached_pages = 32
+
+    def __init__(self, dataset: pd.DataFrame):
+        self.dataset = dataset
+        isos = [country_geometries.iso_code(name) for name in dataset["name"]]
+        summary = dataset.assign(iso=isos).reindex(columns=self.summary_columns)
+        self.countries = RenderedPage(
+            summary.to_json(orient="records"), mimetype="application/json"
         )
+
+        # Index each country by name and ISO code
+        self._rows = {}
+        for row, (name, iso) in enumerate(zip(dataset["name"], isos)):
+            self._rows.setdefault(name.casefold(), row)
+            if iso is not None:
+                self._rows.setdefault(iso.casefold(), row)
+
+        # Row -> RenderedPage, least recently requested first
+        self._country_pages = OrderedDict()
+        self._pages_lock = threading.Lock()
+
+    def country(self, name: str) -> RenderedPage:
+        """
+        Gets the response for a country
+
+        Args:
+            name (str): Name, GOV.UK name or ISO code of the country
+        Returns:
+            RenderedPage: JSON of all of the country's travel advice, None if
+                the country isn't in the dataset
+        """
+        row = self._rows.get(name.casefold())
+        if row is None:
+            # GOV.UK spellings and aliases the dataset's names were mapped from
+            iso = country_geometries.iso_code(name)
+            row = None if iso is None else self._rows.get(iso.casefold())
+        if row is None:
+            return None
+
+        with self._pages_lock:
+            page = self._country_pages.get(row)
+            if page is not None:
+                self._country_pages.move_to_end(row)
+                return page
+
+        page = RenderedPage(
+            self.dataset.iloc[[row]].to_json(orient="records", lines=True).strip(),
+            mimetype="application/json",
+        )
+
+        with self._pages_lock:
+            self._country_pages[row] = page
+            if len(self._country_pages) > self.max_cached_pages:
+                self._country_pages.popitem(last=False)
+
+        return page
+
+
+travel_advice_map_cache = RenderedPageCache(render_travel_advice_map)
+travel_advice_api_cache = DatasetVersionCache(TravelAdviceApi)
+
+
+@app.route("/")
+def index():
+    travel_advice_dataset, version, _ = travel_advice_store.snapshot()
+    page = travel_advice_map_cache.get(travel_advice_dataset, version)
+    return page.response(request)
+
+
+@app.route("/api/countries")
+def countries_api():
+    travel_advice_dataset, version, _ = travel_advice_store.snapshot()
+    api = travel_advice_api_cache.get(travel_advice_dataset, version)
+    return api.countries.response(request)
+
+
+@app.route("/api/countries/<name>")
+def country_api(name):
+    travel_advice_dataset, version, _ = travel_advice_store.snapshot()
+    page = travel_advice_api_cache.get(travel_advice_dataset, version).country(name)
+    if page is None:
+        return jsonify(error=f"No travel advice for {name}"), 404
+    return page.response(request)
+
+
+@app.route("/status")
+def status():
+    dataset, version, loaded_at = travel_advice_store.snapshot()
+    return jsonify(
+        version=version,
+        loaded_at=loaded_at,
+        age=None if loaded_at is None else time.time() - loaded_at,
+        countries=len(dataset),
+        map_cache={
+            "hits": travel_advice_map_cache.hits,
+            "misses": travel_advice_map_cache.misses,
+        },
+        api_cache={
+            "hits": travel_advice_api_cache.hits,
+            "misses": travel_advice_api_cache.misses,
+        },
     )
 
-    return the_map._repr_html_()
+
+@app.route("/metrics")
+def metrics():
+    lines = [
+        "# HELP travel_advice_stage_seconds Time spent in each stage of "
+        "building the dataset and serving the map",
+        "# TYPE travel_advice_stage_seconds summary",
+    ]
+    maximums = []
+    for stage, timings in stage_metrics.summary().items():
+        lines.append(
+            f'travel_advice_stage_seconds_count{{stage="{stage}"}} {timings["count"]}'
+        )
+        lines.append(
+            f'travel_advice_stage_seconds_sum{{stage="{stage}"}} {timings["total"]}'
+        )
+        maximums.append(
+            f'travel_advice_stage_seconds_max{{stage="{stage}"}} {timings["max"]}'
+        )
+    lines.append(
+        "# HELP travel_advice_stage_seconds_max Longest time spent in each stage"
+    )
+    lines.append("# TYPE travel_advice_stage_seconds_max gauge")
+    lines.extend(maximums)
+
+    lines.append("# HELP travel_advice_cache_hits_total Responses served from cache")
+    lines.append("# TYPE travel_advice_cache_hits_total counter")
+    lines.append(
+        f'travel_advice_cache_hits_total{{cache="map"}} {travel_advice_map_cache.hits}'
+    )
+    lines.append(
+        f'travel_advice_cache_hits_total{{cache="api"}} {travel_advice_api_cache.hits}'
+    )
+    lines.append(
+        "# HELP travel_advice_cache_misses_total Responses built on a cache miss"
+    )
+    lines.append("# TYPE travel_advice_cache_misses_total counter")
+    lines.append(
+        f'travel_advice_cache_misses_total{{cache="map"}} {travel_advice_map_cache.misses}'
+    )
+    lines.append(
+        f'travel_advice_cache_misses_total{{cache="api"}} {travel_advice_api_cache.misses}'
+    )
+
+    lines.append("# HELP travel_advice_dataset_version Version of the dataset served")
+    lines.append("# TYPE travel_advice_dataset_version gauge")
+    lines.append(f"travel_advice_dataset_version {travel_advice_store.version}")
+    lines.append("# HELP travel_advice_dataset_countries Countries in the dataset")
+    lines.append("# TYPE travel_advice_dataset_countries gauge")
+    lines.append(f"travel_advice_dataset_countries {len(travel_advice_store.dataset)}")
+    if travel_advice_store.age is not None:
+        lines.append("# HELP travel_advice_dataset_age_seconds Age of the dataset")
+        lines.append("# TYPE travel_advice_dataset_age_seconds gauge")
+        lines.append(f"travel_advice_dataset_age_seconds {travel_advice_store.age}")
+
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
+    travel_advice_store.start()
     app.run(host="0.0.0.0", port=888)
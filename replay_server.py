@@ -0,0 +1,292 @@
+"""
+Local stand-in for the GOV.UK content API, replaying recorded responses so
+the dataset can be built and benchmarked offline
+
+Usage:
+    python replay_server.py record test_data/content_api.json
+    python replay_server.py serve test_data/content_api.json --latency 0.05
+    FOREIGN_TRAVEL_ADVICE_URL=http://127.0.0.1:8000/api/content/foreign-travel-advice python main.py
+"""
+
+import argparse
+import copy
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from main import (
+    CONTENT_API_TIMEOUT,
+    FOREIGN_TRAVEL_ADVICE_URL,
+    create_session,
+    fetch_travel_advice_listing,
+)
+
+CONTENT_API_PREFIX = "/api/content"
+LISTING_PATH = "/foreign-travel-advice"
+RECORDINGS_PATH = "test_data/content_api.json"
+
+
+def load_recordings(path: str = RECORDINGS_PATH) -> dict:
+    """
+    Loads recorded content API responses
+
+    Args:
+        path (str): Path of the JSON file of recordings
+    Returns:
+        dict: Dictionary containing the base path of each document, eg.
+            /foreign-travel-advice/greece, and the document
+    """
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def record_content_api(
+    url: str = FOREIGN_TRAVEL_ADVICE_URL, timeout: float = CONTENT_API_TIMEOUT
+) -> dict:
+    """
+    Records the listing and the document of every country from the content API
+
+    Args:
+        url (str): Content API url listing foreign travel advice
+        timeout (float): Timeout in seconds for each request
+    Returns:
+        dict: Dictionary containing the base path of each document and the
+            document
+    """
+    with create_session() as session:
+        listing = session.get(url, timeout=timeout).json()
+        recordings = {listing["base_path"]: listing}
+        for link in fetch_travel_advice_listing(url, timeout):
+            document = session.get(link["api_url"], timeout=timeout).json()
+            recordings[document["base_path"]] = document
+
+    return recordings
+
+
+def clone_recordings(recordings: dict, copies: int) -> dict:
+    """
+    Multiplies the countries in the recordings, so a few recorded countries
+    can stand in for the full listing
+
+    Args:
+        recordings (dict): Recorded content API responses
+        copies (int): Number of copies of each country
+    Returns:
+        dict: Recordings with each country copied under a new name and path
+    """
+    listing = copy.deepcopy(recordings[LISTING_PATH])
+    children = []
+    cloned = {LISTING_PATH: listing}
+
+    for link in recordings[LISTING_PATH]["links"]["children"]:
+        for i in range(copies):
+            path = f"{link['base_path']}-{i}"
+            name = f"{link['details']['country']['name']} {i}"
+
+            child = copy.deepcopy(link)
+            child["base_path"] = path
+            child["details"]["country"]["name"] = name
+            children.append(child)
+
+            document = copy.deepcopy(recordings[link["base_path"]])
+            document["base_path"] = path
+            document["details"]["country"]["name"] = name
+            cloned[path] = document
+
+    listing["links"]["children"] = children
+    return cloned
+
+
+class ContentApiReplayServer:
+    """
+    Serves recorded content API responses over HTTP from a background thread,
+    with optional latency, failures and throttling to mimic the real API
+
+    Args:
+        recordings (dict): Recorded content API responses, keyed by base path
+        latency (float): Seconds to wait before answering each request
+        error_rate (float): Fraction of requests answered with a 503
+        rate_limit (float): Requests per second allowed before answering with
+            a 429, or None for no limit
+        seed (int): Seed of the random failures
+        host (str): Host to listen on
+        port (int): Port to listen on, or 0 for any free port
+    """
+
+    def __init__(
+        self,
+        recordings: dict,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: float = None,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.recordings = recordings
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.counts = {"requests": 0, "errors": 0, "throttled": 0, "not_modified": 0}
+        self._random = random.Random(seed)
+        self._requests_this_second = (0, 0)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{CONTENT_API_PREFIX}"
+
+    @property
+    def url(self) -> str:
+        """Url listing foreign travel advice, in place of the content API's"""
+        return self.base_url + LISTING_PATH
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self.wait()
+
+    def wait(self):
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    def fault(self) -> int:
+        """Picks the status of a throttled or failed response, if any"""
+        with self._lock:
+            self.counts["requests"] += 1
+
+            if self.rate_limit is not None:
+                second, count = self._requests_this_second
+                now = int(time.monotonic())
+                count = count + 1 if now == second else 1
+                self._requests_this_second = (now, count)
+                if count > self.rate_limit:
+                    self.counts["throttled"] += 1
+                    return 429
+
+            if self._random.random() < self.error_rate:
+                self.counts["errors"] += 1
+                return 503
+
+        return None
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def document(self, path: str) -> dict:
+        """Looks up the recorded document, pointing listed urls at this server"""
+        document = self.recordings.get(path[len(CONTENT_API_PREFIX) :])
+        if document is None or "links" not in document:
+            return document
+
+        document = copy.deepcopy(document)
+        for link in document["links"].get("children", []):
+            link["api_url"] = self.base_url + link["base_path"]
+        return document
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+
+                status = server.fault()
+                if status is not None:
+                    headers = {"Retry-After": "1"} if status == 429 else {}
+                    self._respond(status, headers=headers)
+                    return
+
+                document = server.document(self.path)
+                if document is None:
+                    self._respond(404)
+                    return
+
+                etag = f'"{document.get("updated_at", "")}"'
+                if self.headers.get("If-None-Match") == etag:
+                    server.count("not_modified")
+                    self._respond(304, headers={"ETag": etag})
+                    return
+
+                body = json.dumps(document).encode("utf-8")
+                self._respond(
+                    200, body, {"ETag": etag, "Content-Type": "application/json"}
+                )
+
+            def _respond(self, status: int, body: bytes = b"", headers: dict = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="Record the live content API")
+    record.add_argument("path", nargs="?", default=RECORDINGS_PATH)
+    record.add_argument("--url", default=FOREIGN_TRAVEL_ADVICE_URL)
+
+    serve = commands.add_parser("serve", help="Replay recorded responses")
+    serve.add_argument("path", nargs="?", default=RECORDINGS_PATH)
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--copies", type=int, default=1)
+    serve.add_argument("--latency", type=float, default=0.0)
+    serve.add_argument("--error-rate", type=float, default=0.0)
+    serve.add_argument("--rate-limit", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        with open(args.path, "w", encoding="utf-8") as file:
+            json.dump(record_content_api(args.url), file, indent=2, ensure_ascii=False)
+        return
+
+    recordings = load_recordings(args.path)
+    if args.copies > 1:
+        recordings = clone_recordings(recordings, args.copies)
+    server = ContentApiReplayServer(
+        recordings,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        port=args.port,
+    )
+    print(f"Replaying content API at {server.url}")
+    server.start()
+    try:
+        server.wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,202 @@
+import gzip
+import json
+import os
+import random
+import re
+import time
 import pandas as pd
 import pytest
 import numpy as np
-from main import extract_covid_requirements, build_foreign_travel_advice_dataset
+import requests
+import main
+from main import (
+    COUNTRY_NAME_LOOKUP,
+    CountryDocumentCache,
+    DatasetSnapshots,
+    extract_covid_requirements,
+    build_foreign_travel_advice_dataset,
+    RateLimiter,
+    RenderedPageCache,
+    country_geometries,
+    extract_entry_requirement_sections,
+    HtmlSectionIndex,
+    render_travel_advice_map,
+    TravelAdviceDatasetBuilder,
+    TravelAdviceDatasetLoader,
+    TravelAdviceDatasetStore,
+)
+from replay_server import ContentApiReplayServer, clone_recordings, load_recordings
+
+# Benchmarks are slow so only run when explicitly requested
+run_benchmarks = pytest.mark.skipif(
+    not os.environ.get("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS=1 to run"
+)
+
+# Largest dataset the row by row pd.concat approach is benchmarked on
+LEGACY_BENCHMARK_LIMIT = int(os.environ.get("LEGACY_BENCHMARK_LIMIT", 10_000))
+
+PART_SLUGS = [
+    "coronavirus",
+    "safety-and-security",
+    "terrorism",
+    "local-laws-and-customs",
+    "entry-requirements",
+    "health",
+    "natural-disasters",
+    "money",
+    "travel-advice-help-and-support",
+    "arctic-travel",
+]
+
+
+def make_synthetic_documents(n_documents: int, seed: int = 0) -> list:
+    """Generates content API style documents where some parts are missing"""
+    rng = random.Random(seed)
+    country_names = list(COUNTRY_NAME_LOOKUP) + ["Greece", "Sweden", "Thailand"]
+
+    documents = []
+    for i in range(n_documents):
+        parts = [
+            {"slug": slug, "body": f'<h2 id="{slug}">{slug}</h2>\n\n<p>{i}</p>'}
+            for slug in PART_SLUGS
+            if rng.random() < 0.9
+        ]
+        documents.append(
+            {
+                "details": {
+                    "country": {"name": rng.choice(country_names)},
+                    "parts": parts,
+                }
+            }
+        )
+    return documents
+
+
+def build_dataset_with_concat(documents: list) -> pd.DataFrame:
+    """Builds the dataset one row at a time, as the app used to"""
+    dataset = pd.DataFrame()
+    country_list = []
+
+    for res in documents:
+        country_list.append(res["details"]["country"]["name"])
+        country_content = {}
+        for part in res["details"]["parts"]:
+            country_content[part["slug"]] = part["body"]
+        country_data = pd.DataFrame(country_content, index=[0])
+        dataset = pd.concat([dataset, country_data], ignore_index=True)
+
+    country_list = [COUNTRY_NAME_LOOKUP.get(item, item) for item in country_list]
+    dataset["name"] = country_list
+
+    return dataset.fillna("")
+
+
+def extract_covid_requirements_with_regex(string: str) -> str:
+    """Extracts entry requirements with a regex, as the app used to"""
+    try:
+        return (
+            '<h3 id="entry-to-'
+            + re.findall(r'h3 id="entry-to-(.+?)</p>\n\n<h3', string, re.DOTALL)[0]
+            + "</p>"
+        )
+    except IndexError:
+        return "No entry rules in response to coronavirus are listed"
+
+
+def make_synthetic_entry_requirements(seed: int) -> str:
+    """Generates entry requirements html with headings and blocks in a random
+    order, including the edge cases of the "Entry to ..." section"""
+    rng = random.Random(seed)
+    blocks = []
+
+    for i in range(rng.randint(0, 12)):
+        kind = rng.choice(["h2", "h3", "entry", "plain-h3", "p", "p", "ul"])
+        if kind == "entry":
+            blocks.append(f'<h3 id="entry-to-country-{i}">Entry to country</h3>')
+        elif kind == "plain-h3":
+            blocks.append("<h3>Untitled</h3>")
+        elif kind in ("h2", "h3"):
+            slug = rng.choice(["visas", "testing-on-arrival", f"section-{i}"])
+            blocks.append(f'<{kind} id="{slug}">{slug}</{kind}>')
+        elif kind == "p":
+            blocks.append(f"<p>Paragraph {i}</p>")
+        else:
+            blocks.append(f"<ul>\n  <li>Item {i}</li>\n</ul>")
+
+    return rng.choice(["\n\n", "\n"]).join(blocks) + "\n"
+
+
+def build_dataset_with_builder(documents: list) -> pd.DataFrame:
+    """Builds the dataset in a single step with TravelAdviceDatasetBuilder"""
+    builder = TravelAdviceDatasetBuilder()
+    for document in documents:
+        builder.add(document)
+    return builder.build()
+
+
+class FakeResponse:
+    """Minimal stand in for requests.Response"""
+
+    def __init__(self, status_code: int, content: bytes = b"", headers: dict = None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeContentApi:
+    """Serves country documents from memory in place of the content API"""
+
+    listing_url = "https://www.gov.uk/api/content/foreign-travel-advice"
+
+    def __init__(self, documents: dict):
+        self.documents = documents
+        self.updated_at = {slug: "2021-10-01T00:00:00Z" for slug in documents}
+        self.list_updated_at = True
+        self.requests = []
+        self.not_modified = 0
+
+    def session(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def get(self, url, timeout=None, headers=None):
+        self.requests.append(url)
+        if url == self.listing_url:
+            children = [
+                {
+                    "api_url": f"{self.listing_url}/{slug}",
+                    "updated_at": (
+                        self.updated_at[slug] if self.list_updated_at else None
+                    ),
+                    "details": {"country": document["details"]["country"]},
+                }
+                for slug, document in self.documents.items()
+            ]
+            return FakeResponse(200, json.dumps({"links": {"children": children}}))
+
+        slug = url.rsplit("/", 1)[-1]
+        etag = f'"{self.updated_at[slug]}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            self.not_modified += 1
+            return FakeResponse(304, headers={"ETag": etag})
+        content = json.dumps(self.documents[slug]).encode()
+        return FakeResponse(200, content, headers={"ETag": etag})
+
+
+@pytest.fixture
+def fake_content_api(monkeypatch):
+    documents = {
+        str(i): document
+        for i, document in enumerate(make_synthetic_documents(5, seed=1))
+    }
+    content_api = FakeContentApi(documents)
+    monkeypatch.setattr(main, "create_session", content_api.session)
+    return content_api
 
 
 @pytest.fixture
@@ -17,20 +212,28 @@ def example_html_requirements_not_present():
 
 
 @pytest.fixture
-def example_country_urls():
+def content_api_server():
+    with ContentApiReplayServer(load_recordings()) as server:
+        yield server
+
+
+@pytest.fixture
+def example_country_urls(content_api_server):
+    base_url = content_api_server.base_url
     example_country_urls = {
-        "Greece": "https://www.gov.uk/api/content/foreign-travel-advice/greece",
-        "Sweden": "https://www.gov.uk/api/content/foreign-travel-advice/sweden",
-        "Thailand": "https://www.gov.uk/api/content/foreign-travel-advice/thailand",
+        "Greece": f"{base_url}/foreign-travel-advice/greece",
+        "Sweden": f"{base_url}/foreign-travel-advice/sweden",
+        "Thailand": f"{base_url}/foreign-travel-advice/thailand",
     }
     return example_country_urls
 
 
 @pytest.fixture
-def example_country_urls_malformed():
+def example_country_urls_malformed(content_api_server):
+    base_url = content_api_server.base_url
     example_country_urls_malformed = {
-        "Greece": "https://www.gov.uk/api/content/foreign-travel-advice/greece",
-        "Sweden": "https://www.gov.uk/api/content/foreign-travel-advice/sweden",
+        "Greece": f"{base_url}/foreign-travel-advice/greece",
+        "Sweden": f"{base_url}/foreign-travel-advice/sweden",
         "Thailand": "This is a missing or malformed url",
     }
     return example_country_urls_malformed
@@ -65,6 +268,120 @@ class TestExtractCovidRequirements:
             == "No entry rules in response to coronavirus are listed"
         )
 
+    def test_extract_covid_requirements_matches_regex(
+        self, example_html_requirements_present, example_html_requirements_not_present
+    ):
+        """Tests that the section index gives exactly the same output as the
+        regex it replaced"""
+
+        test_data = pd.read_csv("test_data/test_data.csv").fillna("")
+        bodies = [
+            example_html_requirements_present,
+            example_html_requirements_not_present,
+            "",
+        ] + test_data["entry-requirements"].tolist()
+        bodies += [make_synthetic_entry_requirements(seed) for seed in range(2000)]
+
+        for body in bodies:
+            assert extract_covid_requirements(
+                body
+            ) == extract_covid_requirements_with_regex(body)
+
+    def test_extract_entry_requirement_sections(
+        self, example_html_requirements_present, example_html_requirements_not_present
+    ):
+        """Tests that other sections are extracted along with the COVID entry
+        requirements"""
+
+        present, not_present = extract_entry_requirement_sections(
+            [example_html_requirements_present, example_html_requirements_not_present]
+        )
+
+        assert present["entry-requirements"] == extract_covid_requirements(
+            example_html_requirements_present
+        )
+        assert present["testing-on-arrival"].startswith(
+            '<h3 id="testing-on-arrival">Testing on arrival</h3>'
+        )
+        assert present["testing-on-arrival"].endswith(
+            "A health locator form with contact details must be completed.</p>"
+        )
+        assert present["visas"].startswith('<h3 id="visas">Visas</h3>')
+        assert present["visas"].endswith(
+            "for return travel to the UK. Sierra Leone "
+            "nationals require a visa for the UK, which can only be issued in a full "
+            "passport.</p>"
+        )
+        assert not_present["testing-on-arrival"] == ""
+        assert not_present["quarantine-requirements"].startswith(
+            '<h3 id="quarantine-requirements">'
+        )
+
+    @run_benchmarks
+    def test_benchmark_extract_covid_requirements(
+        self, example_html_requirements_present, example_html_requirements_not_present
+    ):
+        """Benchmarks extracting the COVID entry requirements and the other
+        sections with the section index against a regex per section"""
+
+        entry_requirements = pd.Series(
+            [example_html_requirements_present, example_html_requirements_not_present]
+            * 5_000
+        )
+        section_patterns = [
+            re.compile(f'<h3 id="{heading_id}">.+?(?=<h[23])', re.DOTALL)
+            for heading_id in ("testing-on-arrival", "quarantine-requirements", "visas")
+        ]
+
+        start = time.perf_counter()
+        entry_requirements.apply(lambda x: extract_covid_requirements_with_regex(x))
+        regex_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        entry_requirements.apply(lambda x: extract_covid_requirements_with_regex(x))
+        for pattern in section_patterns:
+            entry_requirements.apply(lambda x: pattern.findall(x)[:1])
+        regex_sections_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        entry_requirements.apply(lambda x: extract_covid_requirements(x))
+        index_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        extract_entry_requirement_sections(entry_requirements)
+        index_sections_time = time.perf_counter() - start
+
+        print(
+            f"\nCOVID entry requirements: regex {regex_time:.3f}s, "
+            f"section index {index_time:.3f}s ({regex_time / index_time:.1f}x)"
+            f"\nWith 3 more sections: regex {regex_sections_time:.3f}s, "
+            f"section index {index_sections_time:.3f}s "
+            f"({regex_sections_time / index_sections_time:.1f}x)"
+        )
+        assert index_sections_time < regex_sections_time
+
+    @run_benchmarks
+    def test_benchmark_extract_covid_requirements_throughput(self):
+        """Benchmarks documents per second extracted from the recorded
+        entry requirements"""
+
+        entry_requirements = [
+            part["body"]
+            for document in load_recordings().values()
+            for part in document.get("details", {}).get("parts", [])
+            if part["slug"] == "entry-requirements"
+        ] * 2_000
+
+        start = time.perf_counter()
+        for html in entry_requirements:
+            extract_covid_requirements(html)
+        elapsed = time.perf_counter() - start
+
+        print(
+            f"\n{len(entry_requirements)} documents in {elapsed:.3f}s "
+            f"({len(entry_requirements) / elapsed:,.0f} documents/s)"
+        )
+
 
 class TestBuildForeignTravelAdviceDataset:
     """Test suite for Build Foreign Travel Advice Dataset function"""
@@ -102,3 +419,842 @@ class TestBuildForeignTravelAdviceDataset:
         assert np.all(
             foreign_advice_dataset.columns.values == test_data.columns.values
         ) and np.all(foreign_advice_dataset["name"] == test_data["name"])
+
+    @pytest.mark.parametrize("missing_url", ["", "www.gov.uk/greece", "Not a url"])
+    def test_concurrent_fetch_matches_sequential(self, missing_url):
+        """Tests that fetching countries concurrently gives the same dataset,
+        in the same order, as fetching them one at a time, with missing or
+        malformed urls skipped"""
+
+        with ContentApiReplayServer(load_recordings(), latency=0.01) as server:
+            base_url = server.base_url
+            country_urls = {
+                "Thailand": f"{base_url}/foreign-travel-advice/thailand",
+                "Missing": missing_url,
+                "Greece": f"{base_url}/foreign-travel-advice/greece",
+                "Sweden": f"{base_url}/foreign-travel-advice/sweden",
+            }
+
+            sequential = build_foreign_travel_advice_dataset(
+                country_urls, max_workers=1
+            )
+            concurrent = build_foreign_travel_advice_dataset(
+                country_urls, max_workers=8
+            )
+
+        assert sequential["name"].tolist() == ["Thailand", "Greece", "Sweden"]
+        pd.testing.assert_frame_equal(concurrent, sequential)
+
+
+class TestRateLimiter:
+    """Test suite for the client side rate limiter"""
+
+    def test_rate_limiter_spaces_out_calls(self):
+        """Tests that calls beyond the first are delayed to respect the rate"""
+
+        rate_limiter = RateLimiter(20)
+
+        start = time.monotonic()
+        for _ in range(5):
+            rate_limiter.wait()
+
+        # Four intervals of 1/20th of a second must have elapsed
+        assert time.monotonic() - start >= 0.2
+
+    def test_rate_limiter_disabled(self):
+        """Tests that a rate of zero doesn't delay any calls"""
+
+        rate_limiter = RateLimiter(0)
+
+        start = time.monotonic()
+        for _ in range(100):
+            rate_limiter.wait()
+
+        assert time.monotonic() - start < 0.1
+
+
+class TestTravelAdviceDatasetBuilder:
+    """Test suite for building the dataset column by column"""
+
+    def test_builder_matches_concat(self):
+        """Tests that the builder produces exactly the same frame as building
+        it one row at a time"""
+
+        documents = make_synthetic_documents(200)
+
+        pd.testing.assert_frame_equal(
+            build_dataset_with_builder(documents),
+            build_dataset_with_concat(documents),
+        )
+
+    def test_builder_repeated_slug(self):
+        """Tests that the last body is kept when a slug is repeated"""
+
+        builder = TravelAdviceDatasetBuilder()
+        builder.add(
+            {
+                "details": {
+                    "country": {"name": "USA"},
+                    "parts": [
+                        {"slug": "money", "body": "first"},
+                        {"slug": "money", "body": "second"},
+                    ],
+                }
+            }
+        )
+        dataset = builder.build()
+
+        assert dataset["money"].tolist() == ["second"]
+        assert dataset["name"].tolist() == ["United States of America"]
+
+    @run_benchmarks
+    @pytest.mark.parametrize("n_documents", [1_000, 10_000, 100_000])
+    def test_benchmark_builder(self, n_documents):
+        """Benchmarks the builder against building one row at a time"""
+
+        documents = make_synthetic_documents(n_documents)
+
+        start = time.perf_counter()
+        dataset = build_dataset_with_builder(documents)
+        builder_time = time.perf_counter() - start
+        assert len(dataset) == n_documents
+
+        if n_documents > LEGACY_BENCHMARK_LIMIT:
+            print(f"\n{n_documents} documents: builder {builder_time:.3f}s")
+            return
+
+        start = time.perf_counter()
+        build_dataset_with_concat(documents)
+        concat_time = time.perf_counter() - start
+
+        print(
+            f"\n{n_documents} documents: builder {builder_time:.3f}s, "
+            f"pd.concat {concat_time:.3f}s ({concat_time / builder_time:.0f}x)"
+        )
+        assert builder_time < concat_time
+
+
+class TestTravelAdviceDatasetStore:
+    """Test suite for holding and refreshing the travel advice dataset"""
+
+    def test_store_starts_empty(self):
+        """Tests that the store serves an empty dataset before it has loaded"""
+
+        store = TravelAdviceDatasetStore(loader=pd.DataFrame)
+
+        assert store.version == 0
+        assert store.age is None
+        assert list(store.dataset.columns) == [
+            "name",
+            "value",
+            "entry-requirements",
+        ]
+
+    def test_store_refresh_swaps_dataset(self):
+        """Tests that each refresh replaces the dataset and bumps the version"""
+
+        datasets = iter([pd.DataFrame({"name": ["Greece"]}), pd.DataFrame()])
+        store = TravelAdviceDatasetStore(loader=lambda: next(datasets))
+
+        first = store.dataset
+        assert store.refresh() == 1
+        assert store.dataset["name"].tolist() == ["Greece"]
+        assert store.refresh() == 2
+        assert store.dataset.empty and store.age >= 0
+        assert first.empty
+
+    def test_store_keeps_dataset_when_refresh_fails(self):
+        """Tests that a failed refresh leaves the previous dataset in place"""
+
+        def failing_loader():
+            raise ValueError("API unavailable")
+
+        store = TravelAdviceDatasetStore(
+            loader=failing_loader, initial_dataset=pd.DataFrame({"name": ["Greece"]})
+        )
+
+        with pytest.raises(ValueError):
+            store.refresh()
+        assert store.version == 0
+        assert store.dataset["name"].tolist() == ["Greece"]
+
+    def test_store_refreshes_in_background(self):
+        """Tests that reading the store starts refreshing it periodically"""
+
+        store = TravelAdviceDatasetStore(
+            loader=lambda: pd.DataFrame({"name": ["Greece"]}), refresh_interval=0.01
+        )
+
+        try:
+            store.snapshot()
+            deadline = time.monotonic() + 5
+            while store.version < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            store.stop(timeout=5)
+
+        assert store.version >= 3
+        assert store.dataset["name"].tolist() == ["Greece"]
+
+
+class TestCountryDocumentCache:
+    """Test suite for the on disk cache of country documents"""
+
+    def test_cache_persists_entries(self, tmp_path):
+        """Tests that entries can be read back by a new cache instance"""
+
+        entry = {
+            "updated_at": "2021-10-01T00:00:00Z",
+            "etag": '"abc"',
+            "last_modified": None,
+            "document": {"details": {"parts": []}},
+        }
+        CountryDocumentCache(str(tmp_path)).set("https://example.com/a", entry)
+
+        cache = CountryDocumentCache(str(tmp_path))
+        assert cache.get("https://example.com/a") == entry
+        assert cache.get("https://example.com/b") is None
+
+    def test_loader_builds_dataset_when_cache_unwritable(
+        self, fake_content_api, tmp_path
+    ):
+        """Tests that failing to write the cache doesn't fail the refresh and
+        entries are still kept in memory"""
+
+        directory = tmp_path / "cache"
+        directory.write_text("not a directory")
+        cache = CountryDocumentCache(str(directory))
+
+        dataset = TravelAdviceDatasetLoader(cache)()
+
+        assert len(dataset) == 5
+        assert cache.get(f"{fake_content_api.listing_url}/0") is not None
+
+
+class TestTravelAdviceDatasetLoader:
+    """Test suite for incrementally loading the travel advice dataset"""
+
+    def test_loader_only_fetches_changed_countries(self, fake_content_api, tmp_path):
+        """Tests that a warm load only fetches the countries which changed and
+        gives the same dataset as a cold load"""
+
+        loader = TravelAdviceDatasetLoader(CountryDocumentCache(str(tmp_path)))
+        cold_dataset = loader()
+        assert len(fake_content_api.requests) == 6
+
+        fake_content_api.requests.clear()
+        fake_content_api.updated_at["3"] = "2021-10-02T00:00:00Z"
+        warm_dataset = loader()
+
+        assert fake_content_api.requests == [
+            fake_content_api.listing_url,
+            f"{fake_content_api.listing_url}/3",
+        ]
+        assert warm_dataset["updated_at"][3] == "2021-10-02T00:00:00Z"
+        pd.testing.assert_frame_equal(
+            warm_dataset.drop(columns="updated_at"),
+            cold_dataset.drop(columns="updated_at"),
+        )
+
+    def test_loader_revalidates_with_conditional_get(self, fake_content_api, tmp_path):
+        """Tests that cached documents are revalidated with the ETag when the
+        listing has no updated_at to compare"""
+
+        TravelAdviceDatasetLoader(CountryDocumentCache(str(tmp_path)))()
+        fake_content_api.list_updated_at = False
+        fake_content_api.requests.clear()
+
+        dataset = TravelAdviceDatasetLoader(CountryDocumentCache(str(tmp_path)))()
+
+        assert len(fake_content_api.requests) == 6
+        assert fake_content_api.not_modified == 5
+        assert len(dataset) == 5
+
+
+@pytest.fixture
+def map_client(monkeypatch):
+    renders = []
+
+    def render(dataset):
+        renders.append(len(dataset))
+        return f"<html>{len(dataset)} countries</html>"
+
+    monkeypatch.setattr(main, "travel_advice_map_cache", RenderedPageCache(render))
+    monkeypatch.setattr(
+        main,
+        "travel_advice_store",
+        TravelAdviceDatasetStore(loader=pd.DataFrame, refresh_interval=3600),
+    )
+    monkeypatch.setattr(main.travel_advice_store, "start", lambda: None)
+    return main.app.test_client(), renders
+
+
+class TestRenderedPageCache:
+    """Test suite for caching the rendered map"""
+
+    def test_map_only_rendered_when_dataset_changes(self, map_client):
+        """Tests that the map is rendered once per dataset version"""
+
+        client, renders = map_client
+
+        assert client.get("/").data == b"<html>0 countries</html>"
+        assert client.get("/").data == b"<html>0 countries</html>"
+        assert renders == [0]
+
+        main.travel_advice_store._snapshot = (pd.DataFrame({"name": ["Greece"]}), 1, 0)
+        assert client.get("/").data == b"<html>1 countries</html>"
+        assert renders == [0, 1]
+        assert (
+            main.travel_advice_map_cache.hits,
+            main.travel_advice_map_cache.misses,
+        ) == (1, 2)
+
+    def test_map_rerendered_when_versions_restart(self, map_client):
+        """Tests that a cached map isn't served for a lower version, as the
+        versions restart when the snapshots are reset"""
+
+        client, renders = map_client
+
+        main.travel_advice_store._snapshot = (pd.DataFrame({"name": ["Greece"]}), 3, 0)
+        assert client.get("/").data == b"<html>1 countries</html>"
+        main.travel_advice_store._snapshot = (pd.DataFrame(), 1, 0)
+        assert client.get("/").data == b"<html>0 countries</html>"
+        assert renders == [1, 0]
+
+    def test_map_served_compressed_and_conditionally(self, map_client):
+        """Tests that the map is served gzipped and revalidated with its ETag"""
+
+        client, _ = map_client
+
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(response.data) == b"<html>0 countries</html>"
+
+        response = client.get(
+            "/",
+            headers={
+                "Accept-Encoding": "gzip",
+                "If-None-Match": response.headers["ETag"],
+            },
+        )
+        assert response.status_code == 304
+        assert response.data == b""
+
+
+class TestCountryGeometryStore:
+    """Test suite for the vendored country shapes"""
+
+    @pytest.mark.parametrize(
+        "name, iso",
+        [
+            ("Greece", "GRC"),
+            ("USA", "USA"),
+            ("United States of America", "USA"),
+            ("United Republic of Tanzania", "TZA"),
+            ("Ivory Coast", "CIV"),
+            ("Democratic Republic of the Congo", "COD"),
+            ("The Bahamas", "BHS"),
+            ("grc", "GRC"),
+        ],
+    )
+    def test_iso_code(self, name, iso):
+        """Tests that GOV.UK names, aliases and ISO codes map to the ISO code"""
+
+        assert country_geometries.iso_code(name) == iso
+
+    def test_listed_countries_have_iso_codes(self):
+        """Tests that every country in the recorded listing, and every name
+        in the lookup tables, is joined to a shape"""
+
+        listing = load_recordings()["/foreign-travel-advice"]["links"]["children"]
+        names = [child["details"]["country"]["name"] for child in listing]
+        names += list(main.COUNTRY_ISO_CODES) + list(COUNTRY_NAME_LOOKUP)
+
+        missing = [name for name in names if country_geometries.iso_code(name) is None]
+
+        assert missing == []
+
+    def test_iso_code_unknown_country(self):
+        """Tests that unknown countries don't have an ISO code"""
+
+        assert country_geometries.iso_code("Atlantis") is None
+
+    def test_feature_collection(self):
+        """Tests that only countries with properties are included and that
+        the map's shapes are lighter than the originals"""
+
+        properties = {"GRC": {"name": "Greece"}, "SWE": {"name": "Sweden"}}
+
+        full = main.load_country_geometries(tolerance=0.0).feature_collection(
+            properties
+        )
+        coarse = country_geometries.feature_collection(properties)
+
+        assert [feature["id"] for feature in full["features"]] == ["GRC", "SWE"]
+        assert full["features"][0]["properties"] == {"name": "Greece"}
+        assert len(str(coarse)) < len(str(full))
+
+
+class TestRenderTravelAdviceMap:
+    """Test suite for rendering the map"""
+
+    def test_render_travel_advice_map(self):
+        """Tests that the map only includes each country's shape and value,
+        with entry requirements loaded from the API"""
+
+        travel_advice_dataset = pd.DataFrame(
+            {
+                "name": ["Greece", "USA", "Atlantis"],
+                "value": [100, 0, 100],
+                "entry-requirements": ["Entry to Greece", "No entry rules", ""],
+            }
+        )
+
+        html = render_travel_advice_map(travel_advice_dataset)
+
+        assert "GRC" in html and "USA" in html
+        assert "Entry to Greece" not in html
+        assert "/api/countries" in html
+        assert "if (!response.ok)" in html
+
+    def test_render_travel_advice_map_empty(self):
+        """Tests that a map is rendered before the dataset has loaded"""
+
+        html = render_travel_advice_map(
+            pd.DataFrame(columns=["name", "value", "entry-requirements"])
+        )
+
+        assert "folium" in html
+
+    @run_benchmarks
+    def test_benchmark_render_travel_advice_map(self, monkeypatch):
+        """Benchmarks rendering the map of every country, cold and then served
+        from cache"""
+
+        names = list(country_geometries.names.values())
+        travel_advice_dataset = pd.DataFrame(
+            {"name": names, "value": [i % 2 * 100 for i in range(len(names))]}
+        )
+        store = TravelAdviceDatasetStore(
+            loader=pd.DataFrame, initial_dataset=travel_advice_dataset
+        )
+        monkeypatch.setattr(store, "start", lambda: None)
+        monkeypatch.setattr(main, "travel_advice_store", store)
+        monkeypatch.setattr(
+            main, "travel_advice_map_cache", RenderedPageCache(render_travel_advice_map)
+        )
+        client = main.app.test_client()
+
+        start = time.perf_counter()
+        client.get("/")
+        cold_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(100):
+            client.get("/", headers={"Accept-Encoding": "gzip"})
+        warm_time = (time.perf_counter() - start) / 100
+
+        print(
+            f"\n{len(names)} countries: cold render {cold_time * 1000:.1f}ms, "
+            f"cached {warm_time * 1000:.2f}ms"
+        )
+        assert warm_time < cold_time
+
+
+class TestCountriesApi:
+    """Test suite for the countries JSON API"""
+
+    @pytest.fixture
+    def api_client(self, monkeypatch):
+        travel_advice_dataset = pd.DataFrame(
+            {
+                "entry-requirements": [
+                    "Entry to Greece",
+                    "No entry rules",
+                    "Entry to Serbia",
+                    "Entry to The Gambia",
+                    "Entry to Myanmar",
+                    "Entry to North Macedonia",
+                ],
+                "health": ["<p>Health</p>", "", "", "", "", ""],
+                "name": [
+                    "Greece",
+                    "United States of America",
+                    "Republic of Serbia",
+                    "Gambia",
+                    "Myanmar",
+                    "Macedonia",
+                ],
+                "value": [100, 0, 100, 0, 100, 0],
+                "updated_at": ["2021-10-01T00:00:00Z", None, None, None, None, None],
+            }
+        )
+        store = TravelAdviceDatasetStore(
+            loader=pd.DataFrame, initial_dataset=travel_advice_dataset
+        )
+        monkeypatch.setattr(store, "start", lambda: None)
+        monkeypatch.setattr(main, "travel_advice_store", store)
+        monkeypatch.setattr(
+            main,
+            "travel_advice_api_cache",
+            main.DatasetVersionCache(main.TravelAdviceApi),
+        )
+        return main.app.test_client()
+
+    def test_countries(self, api_client):
+        """Tests that each country is listed with its value and last update"""
+
+        response = api_client.get("/api/countries")
+
+        assert response.json == [
+            {
+                "name": "Greece",
+                "iso": "GRC",
+                "value": 100,
+                "updated_at": "2021-10-01T00:00:00Z",
+            },
+            {
+                "name": "United States of America",
+                "iso": "USA",
+                "value": 0,
+                "updated_at": None,
+            },
+            {
+                "name": "Republic of Serbia",
+                "iso": "SRB",
+                "value": 100,
+                "updated_at": None,
+            },
+            {"name": "Gambia", "iso": "GMB", "value": 0, "updated_at": None},
+            {"name": "Myanmar", "iso": "MMR", "value": 100, "updated_at": None},
+            {"name": "Macedonia", "iso": "MKD", "value": 0, "updated_at": None},
+        ]
+
+    @pytest.mark.parametrize(
+        "name, entry_requirements",
+        [
+            ("Greece", "Entry to Greece"),
+            ("greece", "Entry to Greece"),
+            ("GRC", "Entry to Greece"),
+            ("Serbia", "Entry to Serbia"),
+            ("Republic of Serbia", "Entry to Serbia"),
+            ("The Gambia", "Entry to The Gambia"),
+            ("Myanmar (Burma)", "Entry to Myanmar"),
+            ("North Macedonia", "Entry to North Macedonia"),
+            ("USA", "No entry rules"),
+        ],
+    )
+    def test_country(self, api_client, name, entry_requirements):
+        """Tests that a country can be looked up by its name in the dataset,
+        its GOV.UK name or its ISO code"""
+
+        response = api_client.get(f"/api/countries/{name}")
+
+        assert response.json["entry-requirements"] == entry_requirements
+
+    def test_country_health(self, api_client):
+        """Tests that all of the country's travel advice is included"""
+
+        assert api_client.get("/api/countries/GRC").json["health"] == "<p>Health</p>"
+
+    def test_country_not_found(self, api_client):
+        """Tests that unknown countries are a 404"""
+
+        assert api_client.get("/api/countries/Atlantis").status_code == 404
+
+    def test_country_not_modified(self, api_client):
+        """Tests that responses can be revalidated with their ETag"""
+
+        etag = api_client.get("/api/countries/Greece").headers["ETag"]
+        response = api_client.get(
+            "/api/countries/Greece", headers={"If-None-Match": etag}
+        )
+
+        assert response.status_code == 304
+
+    def test_country_pages_built_on_request(self, tmp_path, monkeypatch):
+        """Tests that countries are served from a memory mapped snapshot with
+        only the most recently requested responses cached"""
+
+        snapshots = DatasetSnapshots(str(tmp_path))
+        snapshots.write(
+            pd.DataFrame(
+                {
+                    "name": [f"Country {i}" for i in range(10)],
+                    "value": [i * 10 for i in range(10)],
+                    "entry-requirements": [f"Entry to {i}" for i in range(10)],
+                }
+            )
+        )
+        dataset, _, _ = snapshots.read()
+        monkeypatch.setattr(main.TravelAdviceApi, "max_cached_pages", 3)
+        api = main.TravelAdviceApi(dataset)
+
+        for i in range(10):
+            page = api.country(f"country {i}")
+            assert json.loads(page.bodies["identity"]) == {
+                "name": f"Country {i}",
+                "value": i * 10,
+                "entry-requirements": f"Entry to {i}",
+            }
+
+        assert list(api._country_pages) == [7, 8, 9]
+        assert api.country("Country 9") is page
+
+
+class TestDatasetSnapshots:
+    """Test suite for sharing the dataset between processes via snapshots"""
+
+    @pytest.fixture
+    def travel_advice_dataset(self):
+        travel_advice_dataset = pd.read_csv("test_data/test_data.csv").fillna("")
+        travel_advice_dataset["value"] = [100, 0, 100]
+        return travel_advice_dataset
+
+    def test_snapshot_round_trip(self, tmp_path, travel_advice_dataset):
+        """Tests that a snapshot reads back as the dataset written"""
+
+        snapshots = DatasetSnapshots(str(tmp_path))
+        assert snapshots.read() is None
+
+        assert snapshots.write(travel_advice_dataset) == 1
+        dataset, version, loaded_at = snapshots.read()
+
+        assert version == 1 and loaded_at <= time.time()
+        pd.testing.assert_frame_equal(dataset, travel_advice_dataset, check_dtype=False)
+
+    def test_snapshot_without_arrow_strings(
+        self, tmp_path, travel_advice_dataset, monkeypatch
+    ):
+        """Tests that snapshots are read as object columns on versions of
+        pandas without strings backed by Arrow"""
+
+        monkeypatch.setattr(main, "ARROW_STRING_DTYPE", None)
+        snapshots = DatasetSnapshots(str(tmp_path))
+        snapshots.write(travel_advice_dataset)
+        dataset, _, _ = snapshots.read()
+
+        assert dataset["name"].tolist() == travel_advice_dataset["name"].tolist()
+        assert dataset["name"].dtype != pd.StringDtype("pyarrow")
+
+    def test_snapshot_columns(self, tmp_path, travel_advice_dataset):
+        """Tests that only the requested columns are loaded on top of the
+        columns the map and the countries API need"""
+
+        DatasetSnapshots(str(tmp_path)).write(
+            travel_advice_dataset.assign(updated_at="2021-10-01T00:00:00Z")
+        )
+        dataset, _, _ = DatasetSnapshots(
+            str(tmp_path), columns=["health", "missing"]
+        ).read()
+
+        assert list(dataset.columns) == [
+            "entry-requirements",
+            "health",
+            "name",
+            "value",
+            "updated_at",
+        ]
+
+    def test_snapshot_old_versions_removed(self, tmp_path, travel_advice_dataset):
+        """Tests that only the latest snapshots are kept on disk"""
+
+        snapshots = DatasetSnapshots(str(tmp_path), keep=2)
+        for _ in range(4):
+            snapshots.write(travel_advice_dataset)
+
+        assert sorted(path.name for path in tmp_path.glob("*.arrow")) == [
+            "travel-advice-0000000003.arrow",
+            "travel-advice-0000000004.arrow",
+        ]
+
+    def test_stores_share_snapshots(self, tmp_path, travel_advice_dataset):
+        """Tests that only one store loads the dataset and the others pick up
+        each new version from its snapshots"""
+
+        loads = []
+
+        def loader():
+            loads.append(len(loads))
+            return travel_advice_dataset.assign(value=len(loads))
+
+        writer, reader = [
+            TravelAdviceDatasetStore(
+                loader=loader, snapshots=DatasetSnapshots(str(tmp_path))
+            )
+            for _ in range(2)
+        ]
+
+        assert writer.refresh() == 1
+        assert reader.refresh() == 1
+        assert writer.refresh() == 1
+        assert len(loads) == 1
+        assert reader.dataset["value"].tolist() == [1, 1, 1]
+
+        writer.refresh_interval = 0
+        assert writer.refresh() == 2
+        assert reader.refresh() == 2
+        assert len(loads) == 2
+        assert reader.dataset["value"].tolist() == [2, 2, 2]
+
+    def test_writer_replaces_unreadable_snapshot(self, tmp_path, travel_advice_dataset):
+        """Tests that the writer rebuilds the dataset when the current
+        snapshot can't be read, eg. after its file was cleaned up"""
+
+        snapshots = DatasetSnapshots(str(tmp_path))
+        snapshots.write(travel_advice_dataset)
+        os.remove(tmp_path / "travel-advice-0000000001.arrow")
+
+        store = TravelAdviceDatasetStore(
+            loader=lambda: travel_advice_dataset.assign(value=7),
+            snapshots=DatasetSnapshots(str(tmp_path)),
+        )
+
+        assert store.refresh() == 2
+        assert store.dataset["value"].tolist() == [7, 7, 7]
+
+
+class TestContentApiReplayServer:
+    """Test suite for building the dataset against the local content API"""
+
+    @pytest.fixture
+    def recordings(self):
+        return load_recordings()
+
+    def test_loader_builds_dataset_offline(self, recordings):
+        """Tests that the dataset is built from the recorded responses, with
+        the listing pointing at the replay server"""
+
+        with ContentApiReplayServer(recordings) as server:
+            dataset = TravelAdviceDatasetLoader(url=server.url, rate_limit=None)()
+
+        assert dataset["name"].tolist() == ["Greece", "Sweden", "Thailand"]
+        assert dataset["updated_at"].tolist() == ["2021-10-01T09:00:00Z"] * 3
+        assert server.counts["requests"] == 4
+
+    def test_loader_times_each_stage(self, recordings):
+        """Tests that a load times the listing and the fetch once each and
+        decodes each country's document as its own parse"""
+
+        def counts():
+            summary = main.stage_metrics.summary()
+            return {
+                stage: summary.get(stage, {"count": 0})["count"]
+                for stage in ("listing", "fetch", "parse", "build", "extract")
+            }
+
+        before = counts()
+        with ContentApiReplayServer(recordings) as server:
+            TravelAdviceDatasetLoader(url=server.url, rate_limit=None)()
+        after = counts()
+
+        assert {stage: after[stage] - before[stage] for stage in after} == {
+            "listing": 1,
+            "fetch": 1,
+            "parse": 3,
+            "build": 1,
+            "extract": 1,
+        }
+
+    def test_conditional_get(self, recordings):
+        """Tests that a document is revalidated with its ETag"""
+
+        with ContentApiReplayServer(recordings) as server:
+            url = server.base_url + "/foreign-travel-advice/greece"
+            etag = requests.get(url, timeout=5).headers["ETag"]
+            response = requests.get(url, headers={"If-None-Match": etag}, timeout=5)
+
+        assert response.status_code == 304
+        assert server.counts["not_modified"] == 1
+
+    def test_loader_retries_failed_and_throttled_requests(self, recordings):
+        """Tests that 503s and 429s are retried until the dataset is built"""
+
+        with ContentApiReplayServer(
+            recordings, error_rate=0.3, rate_limit=2, seed=3
+        ) as server:
+            dataset = TravelAdviceDatasetLoader(url=server.url, rate_limit=None)()
+
+        assert len(dataset) == 3
+        assert server.counts["errors"] > 0
+        assert server.counts["throttled"] > 0
+
+    def test_clone_recordings(self, recordings):
+        """Tests that each country is copied under a new name and path"""
+
+        cloned = clone_recordings(recordings, 4)
+        children = cloned["/foreign-travel-advice"]["links"]["children"]
+
+        assert len(children) == 12
+        assert len({child["details"]["country"]["name"] for child in children}) == 12
+        assert all(child["base_path"] in cloned for child in children)
+
+    @run_benchmarks
+    def test_benchmark_build_concurrency(self, recordings):
+        """Benchmarks building the dataset from 300 countries, each taking
+        50ms to fetch, with different numbers of workers"""
+
+        recordings = clone_recordings(recordings, 100)
+        timings = {}
+
+        with ContentApiReplayServer(recordings, latency=0.05) as server:
+            for max_workers in (1, 4, 8, 16):
+                loader = TravelAdviceDatasetLoader(
+                    url=server.url, max_workers=max_workers, rate_limit=None
+                )
+                start = time.perf_counter()
+                dataset = loader()
+                timings[max_workers] = time.perf_counter() - start
+                assert len(dataset) == 300
+
+        print(
+            "\n"
+            + ", ".join(
+                f"{max_workers} workers {elapsed:.2f}s"
+                for max_workers, elapsed in timings.items()
+            )
+        )
+        assert timings[8] < timings[1]
+
+
+class TestMetrics:
+    """Test suite for the /metrics endpoint"""
+
+    def test_metrics(self, map_client):
+        """Tests that stage timings, cache counts and the dataset are exposed
+        in the Prometheus text format"""
+
+        client, _ = map_client
+        client.get("/")
+        with main.stage_metrics.time("fetch"):
+            pass
+
+        response = client.get("/metrics")
+        metrics = response.data.decode()
+
+        assert response.mimetype == "text/plain"
+        assert 'travel_advice_cache_misses_total{cache="map"} 1' in metrics
+        assert 'travel_advice_stage_seconds_count{stage="compress"}' in metrics
+        assert 'travel_advice_stage_seconds_max{stage="fetch"}' in metrics
+        assert "travel_advice_dataset_countries 0" in metrics
+
+    def test_stage_metrics(self):
+        """Tests that each stage is counted and timed, including when used
+        as a decorator"""
+
+        stage_metrics = main.StageMetrics()
+
+        @stage_metrics.time("parse")
+        def parse():
+            time.sleep(0.01)
+
+        parse()
+        parse()
+        with stage_metrics.time("render"):
+            pass
+
+        summary = stage_metrics.summary()
+        assert summary["parse"]["count"] == 2
+        assert summary["parse"]["total"] >= 0.02
+        assert summary["parse"]["max"] >= 0.01
+        assert summary["render"]["count"] == 1